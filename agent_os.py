@@ -17,4 +17,11 @@ app = agent_os.get_app()
 
 if __name__ == "__main__":
     port = int(os.getenv("AGNO_OS_PORT", 7777))
-    agent_os.serve(app="agent_os:app", host="0.0.0.0", port=port, reload=True)
+    dev = os.getenv("DEV") == "1"
+    agent_os.serve(
+        app="agent_os:app",
+        host="0.0.0.0",
+        port=port,
+        reload=dev,
+        workers=1 if dev else int(os.getenv("WORKERS", "1")),
+    )
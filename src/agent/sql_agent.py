@@ -1,67 +1,186 @@
 import os
 import sys
+import re
+import json
+import time
+import atexit
 import logging
-from datetime import datetime, timedelta
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from agno.utils.log import logger
+import functools
+from datetime import datetime
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows has no fcntl; skip file locking there
+    fcntl = None
+_src_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _src_dir not in sys.path:
+    sys.path.insert(0, _src_dir)
 from agno.agent import Agent
 from agno.tools.sql import SQLTools
-from agno.models.openai import OpenAIChat
-from agno.models.azure import AzureOpenAI
-from agno.db.sqlite import SqliteDb
 import httpx
 from dotenv import load_dotenv
+from sqlalchemy import create_engine
 
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+_PROVIDER = os.getenv("MODEL_PROVIDER", "openai").lower()
+
 tiktoken_cache_dir = os.path.abspath("tiktoken_cache")
 os.environ["TIKTOKEN_CACHE_DIR"] = tiktoken_cache_dir
 
+# Load the BPE vocabulary during startup so the first request doesn't pay for
+# it. Imported after TIKTOKEN_CACHE_DIR is set so tiktoken picks up the cache
+# dir. tiktoken is not a declared dependency, so the pre-warm only activates
+# when it has been installed manually; it is a startup optimization and must
+# never prevent the server from booting.
+_ENC = None
+try:
+    import tiktoken
+except ImportError:
+    pass
+else:
+    try:
+        try:
+            _ENC = tiktoken.encoding_for_model(os.getenv("OPENAI_MODEL_ID", "gpt-4"))
+        except KeyError:
+            _ENC = tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # On a cache miss tiktoken fetches the BPE file over the network;
+        # a proxy/network failure here must degrade, not abort startup.
+        logger.warning(f"Could not pre-warm tiktoken encoding: {e}")
+
+_TOKEN_HTTP = httpx.Client(timeout=60, limits=httpx.Limits(max_keepalive_connections=2))
+atexit.register(_TOKEN_HTTP.close)
+
+_TOKEN_CACHE_FILE = os.path.join(
+    os.getenv("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "sql_server_agent",
+    "azure_token.json",
+)
+_token_expiry = 0.0  # unix timestamp of the current Azure token's expiry
+_refresh_deadline = 0.0  # monotonic time after which the token must be refreshed
+
+
+def _set_token_expiry(exp):
+    """Record the token expiry both as wall-clock time (for the on-disk cache
+    and log lines) and as a monotonic deadline for the cheap per-invoke check,
+    refreshing five minutes early."""
+    global _token_expiry, _refresh_deadline
+    _token_expiry = exp
+    _refresh_deadline = time.monotonic() + (exp - time.time()) - 300
+
+
+def _load_cached_token():
+    """Read the on-disk token cache, returning (token, expiry) if still fresh."""
+    try:
+        with open(_TOKEN_CACHE_FILE) as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_SH)
+            data = json.load(f)
+        token, exp = data["token"], float(data["exp"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None, 0.0
+    if exp - time.time() > 300:
+        return token, exp
+    return None, 0.0
+
+
+def _store_cached_token(token, exp):
+    """Atomically write the token cache so other worker processes can reuse it."""
+    try:
+        os.makedirs(os.path.dirname(_TOKEN_CACHE_FILE), exist_ok=True)
+        tmp_path = f"{_TOKEN_CACHE_FILE}.{os.getpid()}.tmp"
+        # The file holds a live bearer token - create it owner-readable only.
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            json.dump({"token": token, "exp": exp}, f)
+        os.replace(tmp_path, _TOKEN_CACHE_FILE)
+    except OSError:
+        logger.warning("Could not write Azure token cache, continuing without it")
+
+
 def get_access_token():
-    """Get Azure AD access token using client credentials flow."""
-    provider = os.getenv("MODEL_PROVIDER", "openai").lower()
+    """Get Azure AD access token using client credentials flow.
 
-    if provider != "azure":
+    Tokens are cached on disk, so worker processes started within the token
+    lifetime reuse it instead of each paying an OAuth round trip on startup.
+    """
+    if _PROVIDER != "azure":
         return "dummy_token_for_compatibility"
 
+    token, exp = _load_cached_token()
+    if token:
+        _set_token_expiry(exp)
+        return token
+
     auth = "https://api.uhg.com/oauth2/token"
     scope = "https://api.uhg.com/.default"
     grant_type = "client_credentials"
     client_id = os.getenv("AZURE_CLIENT_ID")
     client_secret = os.getenv("AZURE_CLIENT_SECRET")
 
-    with httpx.Client() as client:
-        body = {
-            "grant_type": grant_type,
-            "scope": scope,
-            "client_id": client_id,
-            "client_secret": client_secret,
-        }
-        headers = {"Content-Type": "application/x-www-form-urlencoded"}
-        response = client.post(auth, headers=headers, data=body, timeout=60)
-        response.raise_for_status()
-        return response.json()["access_token"]
+    body = {
+        "grant_type": grant_type,
+        "scope": scope,
+        "client_id": client_id,
+        "client_secret": client_secret,
+    }
+    headers = {"Content-Type": "application/x-www-form-urlencoded"}
+    response = _TOKEN_HTTP.post(auth, headers=headers, data=body)
+    response.raise_for_status()
+    payload = response.json()
 
+    token = payload["access_token"]
+    exp = time.time() + float(payload.get("expires_in", 3600))
+    _set_token_expiry(exp)
+    _store_cached_token(token, exp)
+    return token
 
-class AutoRefreshAzureOpenAI(AzureOpenAI):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.token_expiry = datetime.now() + timedelta(hours=1)
-        logger.info(f"Azure model created, token expires at {self.token_expiry.strftime('%H:%M:%S')}")
 
-    def _refresh_token_if_needed(self):
-        now = datetime.now()
-        if now >= self.token_expiry - timedelta(minutes=5):
-            logger.info("Token expiring soon, refreshing...")
-            self.azure_ad_token = get_access_token()
-            self.token_expiry = now + timedelta(hours=1)
-            logger.info(f"Token refreshed, expires at {self.token_expiry.strftime('%H:%M:%S')}")
+@functools.cache
+def _auto_refresh_azure_cls():
+    """Build the auto-refreshing Azure model class on first use.
+
+    Defined lazily so the OpenAI provider path never imports the Azure
+    model module (and its chunk of the SDK) at startup.
+    """
+    from agno.models.azure import AzureOpenAI
+
+    class AutoRefreshAzureOpenAI(AzureOpenAI):
+        def _refresh_token_if_needed(self):
+            if time.monotonic() >= _refresh_deadline:
+                logger.info("Token expiring soon, refreshing...")
+                self.azure_ad_token = get_access_token()
+                # get_client()/get_async_client() cache the OpenAI client built
+                # with the old token; drop them so the next call rebuilds with
+                # the fresh one.
+                self.client = None
+                self.async_client = None
+                expiry = datetime.fromtimestamp(_token_expiry)
+                logger.info(f"Token refreshed, expires at {expiry.strftime('%H:%M:%S')}")
 
-    def invoke(self, *args, **kwargs):
-        self._refresh_token_if_needed()
-        return super().invoke(*args, **kwargs)
+        def invoke(self, *args, **kwargs):
+            self._refresh_token_if_needed()
+            return super().invoke(*args, **kwargs)
+
+        def invoke_stream(self, *args, **kwargs):
+            self._refresh_token_if_needed()
+            return super().invoke_stream(*args, **kwargs)
+
+        def ainvoke(self, *args, **kwargs):
+            self._refresh_token_if_needed()
+            return super().ainvoke(*args, **kwargs)
+
+        def ainvoke_stream(self, *args, **kwargs):
+            self._refresh_token_if_needed()
+            return super().ainvoke_stream(*args, **kwargs)
+
+    return AutoRefreshAzureOpenAI
 
 
 def get_model():
@@ -69,9 +188,9 @@ def get_model():
     Get the AI model based on MODEL_PROVIDER environment variable.
     Switch between providers by changing MODEL_PROVIDER in .env
     """
-    provider = os.getenv("MODEL_PROVIDER", "openai").lower()
+    if _PROVIDER == "openai":
+        from agno.models.openai import OpenAIChat
 
-    if provider == "openai":
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             raise ValueError("OPENAI_API_KEY is required when MODEL_PROVIDER=openai")
@@ -81,12 +200,12 @@ def get_model():
             api_key=api_key
         )
 
-    elif provider == "azure":
+    elif _PROVIDER == "azure":
         project_id = os.getenv("AZURE_PROJECT_ID")
         if not project_id:
             raise ValueError("AZURE_PROJECT_ID is required when MODEL_PROVIDER=azure")
 
-        return AutoRefreshAzureOpenAI(
+        return _auto_refresh_azure_cls()(
             id=os.getenv("AZURE_MODEL_ID", "gpt-4.1"),
             azure_deployment=os.getenv("AZURE_DEPLOYMENT", "gpt-4.1_2025-04-14"),
             api_version=os.getenv("AZURE_API_VERSION", "2025-01-01-preview"),
@@ -96,11 +215,16 @@ def get_model():
         )
 
     else:
-        raise ValueError(f"Unsupported MODEL_PROVIDER: {provider}. Supported: openai, azure")
+        raise ValueError(f"Unsupported MODEL_PROVIDER: {_PROVIDER}. Supported: openai, azure")
 
 
+@functools.cache
 def _build_db_url(db_url=None):
-    """Build SQL Server connection string from environment variables."""
+    """Build SQL Server connection string from environment variables.
+
+    Cached so repeated agent creations skip the env lookups; use
+    _build_db_url.cache_clear() in tests that change connection env vars.
+    """
     if db_url is not None:
         return db_url
 
@@ -116,6 +240,96 @@ def _build_db_url(db_url=None):
         return f"mssql+pyodbc://{username}:{password}@{host}/{database}?driver=ODBC+Driver+17+for+SQL+Server"
 
 
+class CachedSQLTools(SQLTools):
+    """SQLTools with a TTL cache over schema introspection.
+
+    Table lists and column metadata rarely change, so re-querying
+    INFORMATION_SCHEMA on every agent invocation only adds round trips to
+    SQL Server. Results are cached for 10 minutes; the agent is read-only
+    by instruction, so it never issues DDL that would invalidate them.
+    """
+
+    SCHEMA_CACHE_TTL = 600  # seconds
+    MAX_RESULT_ROWS = 1000
+
+    _SELECT_RE = re.compile(r"^(\s*SELECT\b(?:\s+(?:DISTINCT|ALL)\b)?)", re.IGNORECASE)
+    _BOUNDED_RE = re.compile(r"\bTOP\s*\(?\s*\d|\bLIMIT\s+\d|\bFETCH\s+(?:FIRST|NEXT)\b", re.IGNORECASE)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._schema_cache = {}
+
+    def _cached(self, key, fetch):
+        hit = self._schema_cache.get(key)
+        now = time.monotonic()
+        if hit is not None and now - hit[0] < self.SCHEMA_CACHE_TTL:
+            return hit[1]
+        value = fetch()
+        # The parent tools report failures as "Error ..." strings rather than
+        # raising; don't cache those, or one transient SQL Server hiccup would
+        # pin the error into tool output for the whole TTL.
+        if not (isinstance(value, str) and value.startswith("Error")):
+            self._schema_cache[key] = (now, value)
+        return value
+
+    def list_tables(self):
+        return self._cached("list_tables", super().list_tables)
+
+    def describe_table(self, table_name: str):
+        fetch = super().describe_table
+        return self._cached(("describe_table", table_name), lambda: fetch(table_name))
+
+    def run_sql_query(self, query: str, limit: Optional[int] = 10) -> str:
+        # No local docstring: the parent's is inherited for the tool schema,
+        # and its signature is mirrored so agno generates the same parameters.
+        # The agent is instructed to use TOP, but the model occasionally
+        # forgets; cap unbounded SELECTs server-side so SQL Server never
+        # ships (and pyodbc never materializes) a full-table result.
+        if self._SELECT_RE.match(query) and not self._BOUNDED_RE.search(query):
+            query = self._SELECT_RE.sub(rf"\1 TOP {self.MAX_RESULT_ROWS}", query, count=1)
+        return super().run_sql_query(query, limit)
+
+
+# Frozen at module scope so every request carries byte-identical instruction
+# text, which keeps the vendor-side prompt-prefix cache hitting.
+_INSTRUCTIONS = (
+    "You are an expert SQL Server database analyst.",
+    "Always explain your SQL queries before executing them.",
+    "For large datasets, use LIMIT or TOP clause to restrict results.",
+    "Provide clear insights and actionable recommendations.",
+    "Focus on read-only analysis – never suggest UPDATE, DELETE, or INSERT operations.",
+)
+
+_engines = {}
+
+
+def _get_engine(db_url):
+    """Return a shared pooled engine for db_url, creating it on first use.
+
+    Reusing one engine per URL keeps the pyodbc connection pool alive across
+    agent rebuilds instead of leaking the old pool until GC. pool_pre_ping
+    avoids the ~1s stale-connection retry on the first query after idle.
+    """
+    engine = _engines.get(db_url)
+    if engine is None:
+        engine = create_engine(
+            db_url,
+            pool_size=10,
+            max_overflow=20,
+            pool_pre_ping=True,
+            pool_recycle=1800,
+            fast_executemany=True,
+        )
+        _engines[db_url] = engine
+    return engine
+
+
+def get_current_datetime():
+    """Get the current date and time, for time-aware questions like
+    'sales this week' or 'what is today's date'."""
+    return datetime.now().isoformat(sep=" ", timespec="seconds")
+
+
 def create_sql_agent(db_url=None):
     """
     Create SQL Server Analysis Agent for AgentOS.
@@ -123,8 +337,9 @@ def create_sql_agent(db_url=None):
     This agent is created once at server startup and serves multiple users.
     User ID and session ID are provided per request by AgentOS.
 
-    Note: For Azure deployments, the server should be restarted every ~55 minutes
-    to refresh expired tokens, or use OpenAI which has no token expiry.
+    Note: For Azure deployments, the bearer token is swapped in place by
+    AutoRefreshAzureOpenAI before each model call, so the agent (and its
+    SQLAlchemy connection pool) stays alive across token refreshes.
 
     Args:
         db_url: Optional SQL Server database URL
@@ -132,8 +347,10 @@ def create_sql_agent(db_url=None):
     Returns:
         Configured Agent instance for AgentOS
     """
+    from agno.db.sqlite import SqliteDb
+
     db_url = _build_db_url(db_url)
-    sql_tools = SQLTools(db_url=db_url)
+    sql_tools = CachedSQLTools(db_engine=_get_engine(db_url))
     model = get_model()
     session_db_file = os.getenv("SESSION_DB_FILE", "agno_sessions.db")
     session_db = SqliteDb(db_file=session_db_file)
@@ -143,23 +360,25 @@ def create_sql_agent(db_url=None):
         model=model,
         db=session_db,
         add_history_to_context=True,
-        num_history_runs=10,
-        add_datetime_to_context=True,
-        tools=[sql_tools],
-        instructions=[
-            "You are an expert SQL Server database analyst.",
-            "Always explain your SQL queries before executing them.",
-            "For large datasets, use LIMIT or TOP clause to restrict results.",
-            "Provide clear insights and actionable recommendations.",
-            "Focus on read-only analysis – never suggest UPDATE, DELETE, or INSERT operations.",
-        ],
+        # Old runs can carry large SQL result previews, so a generous fixed
+        # window balloons the prompt; keep the window short and let session
+        # summaries compactly represent anything older.
+        num_history_runs=int(os.getenv("NUM_HISTORY_RUNS", "5")),
+        enable_session_summaries=True,
+        add_session_summary_to_context=True,
+        # Injecting the current timestamp into the system prompt changes its
+        # first bytes every request and defeats vendor-side prefix caching;
+        # the agent fetches the time through a tool when it actually needs it.
+        add_datetime_to_context=False,
+        tools=[sql_tools, get_current_datetime],
+        instructions=list(_INSTRUCTIONS),
         markdown=True,
     )
 
-    logger.info(f"SQL Server Agent created for AgentOS with {os.getenv('MODEL_PROVIDER', 'openai')} provider")
+    logger.info(f"SQL Server Agent created for AgentOS with {_PROVIDER} provider")
     return agent
 
 
 if __name__ == "__main__":
     agent = create_sql_agent()
-    agent.print_response("Show me all available tables in the database", markdown=True)
+    agent.print_response("Show me all available tables in the database", stream=True, markdown=True)